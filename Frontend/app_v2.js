@@ -290,14 +290,43 @@ const RagUI = () => {
   const [answer, setAnswer] = React.useState("");
 
   const ask = async () => {
-    const res = await fetch("http://localhost:8000/rag/query", {
+    setAnswer("");
+    const res = await fetch("http://localhost:8000/rag/query_stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({ question }),
     });
 
-    const data = await res.json();
-    setAnswer(data.answer || "No answer.");
+    // read Server-Sent Events: show tokens as they arrive
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let text = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+
+      for (const ev of events) {
+        const type = (ev.match(/^event: (.*)$/m) || [])[1];
+        const raw = (ev.match(/^data: (.*)$/m) || [])[1];
+        if (!type || raw === undefined) continue;
+        const payload = JSON.parse(raw);
+
+        if (type === "token") {
+          text += payload;
+          setAnswer(text);
+        } else if (type === "done") {
+          setAnswer(payload.answer || "No answer.");
+        } else if (type === "error") {
+          setAnswer("Error: " + payload);
+        }
+      }
+    }
   };
 
   return (
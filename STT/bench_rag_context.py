@@ -0,0 +1,112 @@
+"""
+Benchmark the RAG answer prompt: plain join of every hit (old behaviour)
+vs. build_context (MMR diversity + adjacent-chunk merge + token budget).
+
+    python bench_rag_context.py "what is the deadline" "summary of lecture 3"
+    python bench_rag_context.py --file questions.txt --top-k 10 --llm
+
+Without --llm only the estimated prompt tokens are compared. With --llm both
+prompts are sent to the answer model; the report then has the real
+prompt_tokens from the API, the latency, and the cosine similarity of the
+two answers (multilingual embedder) as an answer-quality check.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import llm_gateway
+import rag_engine
+
+
+def _prompt_tokens(messages):
+    return sum(rag_engine.estimate_tokens(m["content"]) for m in messages)
+
+
+def _complete(messages):
+    start = time.perf_counter()
+    res = llm_gateway.chat(
+        model="llama-3.1-8b-instant",
+        messages=messages,
+    )
+    elapsed = time.perf_counter() - start
+    usage = getattr(res, "usage", None)
+    return res.choices[0].message.content.strip(), elapsed, getattr(usage, "prompt_tokens", None)
+
+
+def _similarity(a, b):
+    va, vb = rag_engine.embedder.encode([a, b])
+    return float(np.dot(va, vb) / ((np.linalg.norm(va) * np.linalg.norm(vb)) or 1.0))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("questions", nargs="*")
+    ap.add_argument("--file", help="one question per line")
+    ap.add_argument("--top-k", type=int, default=8)
+    ap.add_argument("--budget", type=int, default=rag_engine.CONTEXT_TOKEN_BUDGET)
+    ap.add_argument("--llm", action="store_true", help="also call the LLM and time both prompts")
+    args = ap.parse_args()
+
+    questions = list(args.questions)
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as fh:
+            questions += [line.strip() for line in fh if line.strip()]
+    if not questions:
+        ap.error("no questions given")
+
+    rows = []
+    for q in questions:
+        hits = rag_engine.search(q, args.top_k)["hits"]
+        naive = rag_engine._build_messages(q, hits, budget=None)
+        built = rag_engine._build_messages(q, hits, budget=args.budget)
+        if naive is None or built is None:
+            print(f"[skip] no context for: {q}")
+            continue
+
+        row = {
+            "question": q,
+            "hits": len(hits),
+            "naive_tokens": _prompt_tokens(naive),
+            "built_tokens": _prompt_tokens(built),
+        }
+
+        if args.llm:
+            a_naive, t_naive, p_naive = _complete(naive)
+            a_built, t_built, p_built = _complete(built)
+            row.update({
+                "naive_latency": t_naive,
+                "built_latency": t_built,
+                "naive_tokens": p_naive or row["naive_tokens"],
+                "built_tokens": p_built or row["built_tokens"],
+                "answer_sim": _similarity(a_naive, a_built),
+            })
+
+        rows.append(row)
+
+    if not rows:
+        return
+
+    print(f"\n{'question':40} {'hits':>4} {'tok naive':>10} {'tok built':>10}"
+          + (f" {'s naive':>8} {'s built':>8} {'ans sim':>8}" if args.llm else ""))
+    for r in rows:
+        line = f"{r['question'][:40]:40} {r['hits']:>4} {r['naive_tokens']:>10} {r['built_tokens']:>10}"
+        if args.llm:
+            line += f" {r['naive_latency']:>8.2f} {r['built_latency']:>8.2f} {r['answer_sim']:>8.3f}"
+        print(line)
+
+    naive_tok = sum(r["naive_tokens"] for r in rows)
+    built_tok = sum(r["built_tokens"] for r in rows)
+    print(f"\nprompt tokens: {naive_tok} -> {built_tok} "
+          f"({100.0 * (naive_tok - built_tok) / naive_tok:.1f}% fewer)")
+
+    if args.llm:
+        naive_lat = sum(r["naive_latency"] for r in rows) / len(rows)
+        built_lat = sum(r["built_latency"] for r in rows) / len(rows)
+        sims = [r["answer_sim"] for r in rows]
+        print(f"mean latency: {naive_lat:.2f}s -> {built_lat:.2f}s")
+        print(f"answer similarity: mean {np.mean(sims):.3f}, min {np.min(sims):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Cross-process file lock and atomic JSON writes for state files shared by
+several server workers (RAG index, upload registry).
+"""
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+
+    def _lock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock_fd(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def _unlock_fd(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+_held = threading.local()
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive lock on lock_path across processes; re-entrant within a thread."""
+    depths = getattr(_held, "depths", None)
+    if depths is None:
+        depths = _held.depths = {}
+
+    if depths.get(lock_path):
+        depths[lock_path] += 1
+        try:
+            yield
+        finally:
+            depths[lock_path] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock_fd(fd)
+        depths[lock_path] = 1
+        try:
+            yield
+        finally:
+            depths[lock_path] = 0
+            _unlock_fd(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, obj, **dump_kwargs):
+    """Write obj to a temp file in the same folder, fsync, then rename over path."""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(obj, fh, ensure_ascii=False, **dump_kwargs)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
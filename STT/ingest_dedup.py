@@ -0,0 +1,135 @@
+"""
+Content-addressed ingest.
+
+Uploads are hashed (SHA-256) while they stream to disk and the hash is
+mapped to the session that already holds their results. Transcripts get a
+MinHash signature over word shingles, so re-encoded copies of the same
+recording (different bytes, same speech) are caught before they are
+analysed and indexed again.
+
+Registry file: {"hashes": {sha256: session_id}, "signatures": {session_id: [minhash]}}
+"""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import numpy as np
+
+from file_lock import file_lock, atomic_write_json
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_FILE = os.path.join(BASE_DIR, "content_index.json")
+LOCK_FILE = REGISTRY_FILE + ".lock"
+
+READ_CHUNK = 1 << 20          # bytes per read while streaming an upload
+SHINGLE_WORDS = 5
+MIN_SHINGLES = 30             # shorter transcripts ("Thank you.") are never matched or stored
+NUM_PERM = 128
+NEAR_DUP_JACCARD = 0.85       # estimated Jaccard at/above this = same recording
+
+# 32-bit shingle hashes with a prime just above 2^32 keep a*h + b inside uint64
+_PRIME = np.uint64(4294967311)
+_rng = np.random.RandomState(1607)
+_A = _rng.randint(1, 2 ** 32 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 32 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+# ----------------------------
+# REGISTRY
+# ----------------------------
+def _load_registry():
+    if not os.path.exists(REGISTRY_FILE):
+        return {"hashes": {}, "signatures": {}}
+    with open(REGISTRY_FILE, "r", encoding="utf-8") as fh:
+        reg = json.load(fh)
+    reg.setdefault("hashes", {})
+    reg.setdefault("signatures", {})
+    return reg
+
+
+def lookup_hash(sha):
+    return _load_registry()["hashes"].get(sha)
+
+
+def register_hash(sha, session_id):
+    with file_lock(LOCK_FILE):
+        reg = _load_registry()
+        reg["hashes"][sha] = session_id
+        atomic_write_json(REGISTRY_FILE, reg)
+
+
+def register_signature(session_id, signature):
+    with file_lock(LOCK_FILE):
+        reg = _load_registry()
+        reg["signatures"][session_id] = [int(x) for x in signature]
+        atomic_write_json(REGISTRY_FILE, reg)
+
+
+# ----------------------------
+# EXACT: HASH WHILE STREAMING
+# ----------------------------
+async def save_upload_hashed(upload, dest_path):
+    """Stream an UploadFile to dest_path in READ_CHUNK pieces; return its SHA-256 hex digest."""
+    h = hashlib.sha256()
+    with open(dest_path, "wb") as fh:
+        while True:
+            block = await upload.read(READ_CHUNK)
+            if not block:
+                break
+            h.update(block)
+            await asyncio.to_thread(fh.write, block)
+    return h.hexdigest()
+
+
+# ----------------------------
+# NEAR-DUPLICATE: MINHASH
+# ----------------------------
+def _shingle_hashes(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return np.empty(0, dtype=np.uint64)
+
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+
+
+def transcript_signature(text, block=4096):
+    """
+    MinHash signature (NUM_PERM ints) of the transcript's word shingles, or
+    None when it has fewer than MIN_SHINGLES distinct shingles: short or
+    near-silent transcripts look alike without being the same recording.
+    """
+    hashes = _shingle_hashes(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+
+    sig = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for i in range(0, len(hashes), block):
+        part = hashes[i:i + block]
+        perm = (_A[:, None] * part[None, :] + _B[:, None]) % _PRIME
+        np.minimum(sig, perm.min(axis=1), out=sig)
+    return sig
+
+
+def find_near_duplicate(signature, exclude=None, threshold=NEAR_DUP_JACCARD):
+    """(session_id, estimated Jaccard) of the most similar known transcript at/above threshold, else None."""
+    if signature is None:
+        return None
+
+    known = {s: v for s, v in _load_registry()["signatures"].items() if s != exclude}
+    if not known:
+        return None
+
+    ids = list(known)
+    mat = np.array([known[s] for s in ids], dtype=np.uint64)
+    sims = (mat == np.asarray(signature, dtype=np.uint64)[None, :]).mean(axis=1)
+
+    best = int(np.argmax(sims))
+    if sims[best] >= threshold:
+        return ids[best], float(sims[best])
+    return None
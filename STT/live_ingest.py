@@ -0,0 +1,177 @@
+"""
+Ingestion layer for /ws/live audio chunks.
+
+- one SessionWriter per live session: a bounded asyncio queue drained by a
+  background task into a single open, buffered file, flushed every
+  FLUSH_INTERVAL seconds (no reopen per chunk, no blocking the event loop)
+- put() waits when the queue is full; the websocket handler then stops
+  reading, so TCP backpressure reaches the MediaRecorder client
+- per-session byte cap and admission control on concurrent sessions
+- a failed disk write ends the session with SessionWriteError instead of
+  leaving put()/close() waiting on a queue nobody drains
+- file I/O runs on a small dedicated thread pool, not the loop's default
+  executor, so ffmpeg / Whisper / LLM jobs of finished meetings never make
+  the writers of running sessions wait
+
+Limits are per server process: with `uvicorn --workers N` one node accepts
+up to N * MAX_LIVE_SESSIONS live sessions, so set MAX_LIVE_SESSIONS to the
+node budget divided by the worker count.
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_LIVE_SESSIONS = int(os.getenv("MAX_LIVE_SESSIONS", "200"))            # per worker process
+MAX_QUEUE_CHUNKS = int(os.getenv("LIVE_MAX_QUEUE_CHUNKS", "64"))          # per session
+MAX_SESSION_BYTES = int(os.getenv("LIVE_MAX_SESSION_BYTES", str(512 * 1024 * 1024)))
+FLUSH_INTERVAL = float(os.getenv("LIVE_FLUSH_INTERVAL", "2.0"))           # seconds
+IO_THREADS = int(os.getenv("LIVE_IO_THREADS", "4"))                       # writer I/O pool, per worker process
+WRITE_BUFFER = 1 << 20
+
+_io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="live-io")
+_active = {}
+_stats = {"admitted": 0, "rejected": 0, "bytes": 0, "queue_full_waits": 0}
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class SessionWriteError(Exception):
+    pass
+
+
+async def _io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, fn, *args)
+
+
+class SessionWriter:
+    def __init__(self, session_id, path):
+        self.session_id = session_id
+        self.path = path
+        self.bytes = 0
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUE_CHUNKS)
+        self.error = None
+        self._fh = open(path, "wb", buffering=WRITE_BUFFER)
+        self._task = asyncio.create_task(self._drain())
+
+    def _check(self):
+        if self._task.done():
+            raise SessionWriteError(f"writing {self.path} failed: {self.error or 'writer stopped'}")
+
+    async def _enqueue(self, item):
+        """queue.put that gives up (SessionWriteError) if the drain task dies while waiting."""
+        self._check()
+        if not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+
+        putter = asyncio.ensure_future(self.queue.put(item))
+        await asyncio.wait({putter, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not putter.done():
+            putter.cancel()
+            self._check()
+
+    async def put(self, data):
+        """Queue a chunk; waits (backpressure) while the queue is full."""
+        if self.bytes + len(data) > MAX_SESSION_BYTES:
+            raise SessionLimitError(f"session exceeded {MAX_SESSION_BYTES} bytes")
+        if self.queue.full():
+            _stats["queue_full_waits"] += 1
+        await self._enqueue(data)
+        self.bytes += len(data)
+        _stats["bytes"] += len(data)
+
+    async def _drain(self):
+        try:
+            await self._drain_loop()
+        except Exception as e:
+            # kept for put()/close(); the task then ends normally
+            self.error = e
+            print(f"[LIVE] writer for {self.session_id} failed:", e)
+
+    async def _drain_loop(self):
+        last_flush = time.monotonic()
+        done = False
+        while not done:
+            try:
+                data = await asyncio.wait_for(self.queue.get(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                data = b""
+
+            # take everything already queued and write it in one call
+            parts = []
+            if data is None:
+                done = True
+            else:
+                if data:
+                    parts.append(data)
+                while not self.queue.empty():
+                    nxt = self.queue.get_nowait()
+                    if nxt is None:
+                        done = True
+                        break
+                    parts.append(nxt)
+
+            if parts:
+                await _io(self._fh.write, b"".join(parts))
+
+            if done or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                await _io(self._fh.flush)
+                last_flush = time.monotonic()
+
+    async def close(self):
+        """Write everything still queued, flush to disk and close the file."""
+        try:
+            if not self._task.done():
+                try:
+                    await self._enqueue(None)
+                except SessionWriteError:
+                    pass
+                await self._task
+        finally:
+            await _io(self._sync_close)
+
+        if self.error is not None:
+            raise SessionWriteError(f"writing {self.path} failed: {self.error}")
+
+    def _sync_close(self):
+        try:
+            if self.error is None:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self._fh.close()
+            except Exception as e:
+                self.error = self.error or e
+
+
+def admit(session_id, path):
+    """Open a writer for a new live session, or None if this process is at capacity."""
+    if session_id in _active or len(_active) >= MAX_LIVE_SESSIONS:
+        _stats["rejected"] += 1
+        return None
+    writer = SessionWriter(session_id, path)
+    _active[session_id] = writer
+    _stats["admitted"] += 1
+    return writer
+
+
+async def release(session_id):
+    writer = _active.pop(session_id, None)
+    if writer is not None:
+        await writer.close()
+
+
+def stats():
+    return dict(
+        _stats,
+        pid=os.getpid(),
+        active_sessions=len(_active),
+        max_sessions=MAX_LIVE_SESSIONS,
+        queued_chunks=sum(w.queue.qsize() for w in _active.values()),
+    )
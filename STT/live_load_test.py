@@ -0,0 +1,155 @@
+"""
+Synthetic load generator for /ws/live.
+
+Opens many concurrent sessions that behave like the browser MediaRecorder
+client (one binary chunk every --interval seconds) and reports how many
+sessions were admitted, ingest throughput and send latency percentiles.
+
+    python live_load_test.py --sessions 300 --duration 30
+    python live_load_test.py --sessions 50 --chunk-kb 32 --end   # also run the full pipeline
+    python live_load_test.py --sessions 200 --end-share 0.1 --audio meeting.webm
+
+By default sessions just disconnect at the end, so only ingestion is
+measured; --end sends __END_MEETING__ from every session, --end-share from
+that fraction of them, so meetings finish while others are still
+streaming. Random bytes fail in ffmpeg; pass --audio with a real recording
+(at least --duration long) to get them through ffmpeg and into Whisper.
+Watch GET /live/stats on the server meanwhile.
+"""
+import os
+import time
+import asyncio
+import argparse
+
+try:
+    import websockets
+except ImportError:
+    raise SystemExit("live_load_test needs the 'websockets' package (pip install websockets)")
+
+
+def _ends(i, args):
+    # spread the ending sessions evenly over the run
+    return args.end_share > 0 and int((i + 1) * args.end_share) > int(i * args.end_share)
+
+
+async def run_session(i, args, results):
+    url = f"{args.url.rstrip('/')}/ws/live/loadtest_{args.run_id}_{i}"
+    chunks = args.audio_chunks or [os.urandom(args.chunk_kb * 1024)]
+    latencies = []
+    sent = 0
+    admitted = False
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send("__OUTPUT_TYPE__::analysis")
+            ack = await asyncio.wait_for(ws.recv(), timeout=10)
+            if not str(ack).startswith("__ACK_OUTPUT__"):
+                results["rejected"] += 1
+                return
+
+            results["admitted"] += 1
+            admitted = True
+            deadline = time.monotonic() + args.duration
+            n = 0
+            while time.monotonic() < deadline:
+                chunk = chunks[n % len(chunks)]
+                n += 1
+                t0 = time.perf_counter()
+                await ws.send(chunk)
+                latencies.append(time.perf_counter() - t0)
+                sent += len(chunk)
+                await asyncio.sleep(args.interval)
+
+            if _ends(i, args):
+                results["ended"] += 1
+                await ws.send("__END_MEETING__")
+                t0 = time.perf_counter()
+                try:
+                    while True:
+                        msg = await asyncio.wait_for(ws.recv(), timeout=args.end_timeout)
+                        if str(msg).startswith("__ERROR_FINAL__"):
+                            results["end_errors"].append(str(msg)[len("__ERROR_FINAL__::"):][:60])
+                except Exception:
+                    pass
+                results["end_times"].append(time.perf_counter() - t0)
+    except websockets.exceptions.ConnectionClosed as e:
+        # admission control closes with 1013 (try again later), possibly before the ack
+        if _close_code(e) == 1013 and not admitted:
+            results["rejected"] += 1
+            return
+        results["errors"] += 1
+        if args.verbose:
+            print(f"[session {i}] {e}")
+    except Exception as e:
+        results["errors"] += 1
+        if args.verbose:
+            print(f"[session {i}] {e}")
+    finally:
+        results["bytes"] += sent
+        results["latencies"].extend(latencies)
+
+
+def _close_code(exc):
+    rcvd = getattr(exc, "rcvd", None)
+    return rcvd.code if rcvd is not None else getattr(exc, "code", None)
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="ws://localhost:8000")
+    ap.add_argument("--sessions", type=int, default=100)
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds of audio per session")
+    ap.add_argument("--interval", type=float, default=1.0, help="seconds between chunks (MediaRecorder timeslice)")
+    ap.add_argument("--chunk-kb", type=int, default=16)
+    ap.add_argument("--ramp", type=float, default=5.0, help="seconds over which sessions are started")
+    ap.add_argument("--end", action="store_true", help="send __END_MEETING__ instead of disconnecting")
+    ap.add_argument("--end-share", type=float, default=0.0, help="fraction of sessions that send __END_MEETING__")
+    ap.add_argument("--audio", help="recording whose bytes are sent instead of random data")
+    ap.add_argument("--end-timeout", type=float, default=30.0)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+    args.run_id = int(time.time())
+    if args.end:
+        args.end_share = 1.0
+    args.audio_chunks = None
+    if args.audio:
+        with open(args.audio, "rb") as fh:
+            data = fh.read()
+        size = args.chunk_kb * 1024
+        args.audio_chunks = [data[i:i + size] for i in range(0, len(data), size)]
+
+    results = {"admitted": 0, "rejected": 0, "errors": 0, "bytes": 0, "latencies": [],
+               "ended": 0, "end_times": [], "end_errors": []}
+
+    async def delayed(i):
+        await asyncio.sleep(args.ramp * i / max(args.sessions, 1))
+        await run_session(i, args, results)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(delayed(i) for i in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    lat = results["latencies"]
+    print(f"sessions: {args.sessions} requested, {results['admitted']} admitted, "
+          f"{results['rejected']} rejected, {results['errors']} errors")
+    print(f"ingested: {results['bytes'] / 1e6:.1f} MB in {elapsed:.1f}s "
+          f"({results['bytes'] / 1e6 / elapsed:.2f} MB/s)")
+    print(f"send latency: p50 {_pct(lat, 50) * 1000:.1f} ms, p95 {_pct(lat, 95) * 1000:.1f} ms, "
+          f"p99 {_pct(lat, 99) * 1000:.1f} ms, max {max(lat, default=0) * 1000:.1f} ms")
+    if results["ended"]:
+        ends = results["end_times"]
+        print(f"ended meetings: {results['ended']}, time to final message p50 {_pct(ends, 50):.1f}s, "
+              f"max {max(ends, default=0):.1f}s, {len(results['end_errors'])} ended with __ERROR_FINAL__")
+        for reason in sorted(set(results["end_errors"])):
+            print(f"  {results['end_errors'].count(reason)} x {reason}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
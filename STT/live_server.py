@@ -2,19 +2,23 @@
 import os
 import json
 import uuid
-import time
+import asyncio
 import ffmpeg
+from typing import List, Optional
 from fastapi import FastAPI, WebSocket, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from groq import Groq
 
 import nlp_analyzer
 import nlp_notes
 from report_generator import generate_pdf
 from report_notes_generator import generate_notes_pdf
 import rag_engine
+import transcript_store
+import ingest_dedup
+import live_ingest
+import llm_gateway
 
 # -------------------------------------------------------
 # PATHS
@@ -42,27 +46,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY", ""))
-
-
 # -------------------------------------------------------
 # HELPERS
 # -------------------------------------------------------
 def whisper_transcribe(wav_path):
-    """Transcribe using Groq/Whisper model and return text (UTF-8)."""
-    with open(wav_path, "rb") as f:
-        res = client.audio.transcriptions.create(
-            file=f,
-            model="whisper-large-v3",
-            response_format="verbose_json"
-        )
+    """Transcribe using Groq/Whisper model and return the verbose_json dict (with word timings)."""
+    res = llm_gateway.transcribe(
+        wav_path,
+        model="whisper-large-v3",
+        response_format="verbose_json",
+        timestamp_granularities=["word"]
+    )
 
     try:
         data = res.model_dump()
     except:
         data = res
 
-    return data.get("text", "")
+    return data
+
+
+def save_transcript(session_id, data):
+    """Write <session_id>.txt and the compact word-timestamp store <session_id>.npz."""
+    transcript = data.get("text", "") or ""
+
+    with open(os.path.join(TRANSCRIPT_FOLDER, session_id + ".txt"), "w", encoding="utf-8", errors="ignore") as fh:
+        fh.write(transcript)
+
+    words = data.get("words") or []
+    if words:
+        transcript_store.save_store(transcript_store.store_path(TRANSCRIPT_FOLDER, session_id), words)
+
+    return transcript
 
 
 # -------------------------------------------------------
@@ -75,9 +90,20 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     raw_path = os.path.join(LIVE_TRANSCRIPTS, session_id + ".webm")
     wav_path = os.path.join(LIVE_TRANSCRIPTS, session_id + ".wav")
     txt_path = os.path.join(TRANSCRIPT_FOLDER, session_id + ".txt")
+    words_path = transcript_store.store_path(TRANSCRIPT_FOLDER, session_id)
+
+    # admission control: one buffered writer per session, bounded session count
+    writer = live_ingest.admit(session_id, raw_path)
+    if writer is None:
+        try:
+            await websocket.send_text("__ERROR_FINAL__::Server busy or session already active, try again later")
+            await websocket.close(code=1013)
+        except:
+            pass
+        return
 
-    # cleanup old files
-    for p in [raw_path, wav_path, txt_path]:
+    # cleanup old files (the writer already truncated raw_path)
+    for p in [wav_path, txt_path, words_path]:
         if os.path.exists(p):
             try:
                 os.remove(p)
@@ -91,6 +117,10 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         while True:
             msg = await websocket.receive()
 
+            if msg.get("type") == "websocket.disconnect":
+                # client went away without __END_MEETING__: nothing to process
+                return
+
             # Text messages
             if "text" in msg and msg["text"]:
                 text = msg["text"]
@@ -107,22 +137,33 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                     # client finished sending audio
                     break
 
-            # Binary chunks
+            # Binary chunks (waits while this session's queue is full -> backpressure)
             if "bytes" in msg and msg["bytes"]:
                 try:
-                    with open(raw_path, "ab") as fh:
-                        fh.write(msg["bytes"])
-                except Exception as e:
-                    # continue receiving; we'll log and continue
-                    print("Failed to write chunk:", e)
+                    await writer.put(msg["bytes"])
+                except (live_ingest.SessionLimitError, live_ingest.SessionWriteError) as e:
+                    try:
+                        await websocket.send_text(f"__ERROR_FINAL__::{str(e)}")
+                    except:
+                        pass
+                    return
                 continue
 
-        # small wait to ensure disk flush
-        time.sleep(0.3)
+        # write out everything still queued and close the file
+        try:
+            await live_ingest.release(session_id)
+        except live_ingest.SessionWriteError as e:
+            try:
+                await websocket.send_text(f"__ERROR_FINAL__::{str(e)}")
+            except:
+                pass
+            return
 
-        # convert WebM -> WAV (mono 16k)
+        # convert WebM -> WAV (mono 16k); blocking work runs off the event loop
         try:
-            ffmpeg.input(raw_path).output(wav_path, ac=1, ar=16000).overwrite_output().run(quiet=True)
+            await asyncio.to_thread(
+                ffmpeg.input(raw_path).output(wav_path, ac=1, ar=16000).overwrite_output().run, quiet=True
+            )
         except Exception as e:
             # conversion failed
             try:
@@ -132,9 +173,9 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             return
 
         # Transcribe (Whisper)
-        transcript = ""
+        data = {}
         try:
-            transcript = whisper_transcribe(wav_path)
+            data = await asyncio.to_thread(whisper_transcribe, wav_path)
         except Exception as e:
             try:
                 await websocket.send_text(f"__ERROR_FINAL__::Transcription failed: {str(e)}")
@@ -142,16 +183,18 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 pass
             return
 
-        # Save transcript (UTF-8)
+        # Save transcript (UTF-8) + word timings
+        transcript = data.get("text", "") or ""
+        saved = False
         try:
-            with open(txt_path, "w", encoding="utf-8", errors="ignore") as fh:
-                fh.write(transcript)
+            save_transcript(session_id, data)
+            saved = True
         except Exception as e:
             print("Failed to save transcript:", e)
 
         # ANALYSIS
         try:
-            rawA = nlp_analyzer.analyze_transcript(transcript)
+            rawA = await asyncio.to_thread(nlp_analyzer.analyze_transcript, transcript)
             cleanA = nlp_analyzer.clean_json_output(rawA)
             parsedA = nlp_analyzer.normalize_keys(json.loads(cleanA))
 
@@ -163,7 +206,7 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
 
         # NOTES
         try:
-            rawN = nlp_notes.analyze_notes(transcript)
+            rawN = await asyncio.to_thread(nlp_notes.analyze_notes, transcript)
             cleanN = nlp_analyzer.clean_json_output(rawN)
             parsedN = json.loads(cleanN)
 
@@ -176,21 +219,40 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         # Generate PDFs (if data exists)
         try:
             if selected_output in ["analysis", "both"]:
-                generate_pdf(parsedA, os.path.join(LIVE_REPORTS, session_id + "_analysis.pdf"))
+                await asyncio.to_thread(generate_pdf, parsedA, os.path.join(LIVE_REPORTS, session_id + "_analysis.pdf"))
             if selected_output in ["notes", "both"]:
-                generate_notes_pdf(parsedN, os.path.join(LIVE_REPORTS, session_id + "_notes.pdf"))
+                await asyncio.to_thread(generate_notes_pdf, parsedN, os.path.join(LIVE_REPORTS, session_id + "_notes.pdf"))
         except Exception as e:
             print("PDF generation error:", e)
 
         # ---------- AUTO-BUILD RAG INDEX FOR LIVE SESSION ----------
         try:
-            # Build index for this session so RAG can answer immediately
-            rag_engine.build_index_for_session(session_id)
-            try:
-                await websocket.send_text(f"__RAG_INDEXED__::{session_id}")
-            except:
-                pass
-            print(f"[RAG] Indexed live session: {session_id}")
+            # Same speech as a known session (e.g. a replayed recording) -> don't index it twice
+            if not saved:
+                raise RuntimeError("transcript was not saved")
+
+            signature = await asyncio.to_thread(ingest_dedup.transcript_signature, transcript)
+            near = ingest_dedup.find_near_duplicate(signature, exclude=session_id)
+            if near:
+                try:
+                    await websocket.send_text(f"__RAG_DUPLICATE__::{near[0]}")
+                except:
+                    pass
+                print(f"[DEDUP] Live session {session_id} matches {near[0]}, not indexed")
+            else:
+                # Build index for this session so RAG can answer immediately
+                result = await asyncio.to_thread(rag_engine.build_index_for_session, session_id)
+                if result.get("status") != "ok":
+                    raise RuntimeError(result.get("error", "indexing failed"))
+
+                # only content that made it into the index counts as "seen"
+                if signature is not None:
+                    ingest_dedup.register_signature(session_id, signature)
+                try:
+                    await websocket.send_text(f"__RAG_INDEXED__::{session_id}")
+                except:
+                    pass
+                print(f"[RAG] Indexed live session: {session_id}")
         except Exception as e:
             print("[RAG] Index build error for live session:", e)
             try:
@@ -212,15 +274,46 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             pass
         print("WebSocket handler error:", e)
     finally:
+        try:
+            await live_ingest.release(session_id)
+        except Exception as e:
+            print("Live writer close error:", e)
         try:
             await websocket.close()
         except:
             pass
 
 
+@app.get("/gateway/stats")
+def gateway_stats():
+    return llm_gateway.metrics()
+
+
+@app.get("/live/stats")
+def live_stats():
+    return live_ingest.stats()
+
+
 # -------------------------------------------------------
-# UPLOAD VIDEO (UTF-8 safe + auto-index)
+# UPLOAD VIDEO (UTF-8 safe + auto-index + dedup)
 # -------------------------------------------------------
+def _upload_result(vid):
+    return {
+        "analysis": f"http://localhost:8000/live-report/{vid}_analysis",
+        "notes": f"http://localhost:8000/live-report/{vid}_notes",
+        "session_id": vid
+    }
+
+
+def _remove_files(*paths):
+    for p in paths:
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception as e:
+            print("Failed to remove", p, e)
+
+
 @app.post("/upload-video")
 async def upload_video(file: UploadFile = File(...), output_type: str = Form(...)):
     try:
@@ -228,41 +321,52 @@ async def upload_video(file: UploadFile = File(...), output_type: str = Form(...
         video_path = os.path.join(LIVE_TRANSCRIPTS, vid + ".mp4")
         wav_path = os.path.join(LIVE_TRANSCRIPTS, vid + ".wav")
 
-        # Save uploaded video (raw bytes)
-        with open(video_path, "wb") as f:
-            f.write(await file.read())
+        # Save uploaded video in pieces, hashing it on the way
+        sha = await ingest_dedup.save_upload_hashed(file, video_path)
 
-        # Convert to WAV
+        # Exact same file seen before -> return its existing results
+        existing = ingest_dedup.lookup_hash(sha)
+        if existing and os.path.exists(os.path.join(TRANSCRIPT_FOLDER, existing + ".txt")):
+            _remove_files(video_path)
+            print(f"[DEDUP] Upload matches {existing} (sha256)")
+            return dict(_upload_result(existing), duplicate_of=existing)
+
+        # Convert to WAV; blocking work runs off the event loop so live sessions keep ingesting
         try:
-            ffmpeg.input(video_path).output(wav_path, ac=1, ar=16000).overwrite_output().run(quiet=True)
+            await asyncio.to_thread(
+                ffmpeg.input(video_path).output(wav_path, ac=1, ar=16000).overwrite_output().run, quiet=True
+            )
         except Exception as e:
             return {"error": f"FFMPEG conversion failed: {e}"}
 
         # Transcribe
         try:
-            with open(wav_path, "rb") as audio:
-                t = client.audio.transcriptions.create(
-                    file=audio,
-                    model="whisper-large-v3",
-                    response_format="verbose_json"
-                )
-            try:
-                transcript = t.model_dump().get("text", "")
-            except:
-                transcript = t.get("text", "")
+            data = await asyncio.to_thread(whisper_transcribe, wav_path)
         except Exception as e:
             return {"error": f"Transcription failed: {e}"}
 
-        # Save transcript (UTF-8)
+        # Re-encoded copy of a known recording -> reuse it, skip LLMs/PDFs/indexing
+        transcript = data.get("text", "") or ""
+        signature = await asyncio.to_thread(ingest_dedup.transcript_signature, transcript)
+        near = ingest_dedup.find_near_duplicate(signature)
+        if near:
+            existing, similarity = near
+            ingest_dedup.register_hash(sha, existing)
+            _remove_files(video_path, wav_path)
+            print(f"[DEDUP] Upload matches {existing} (minhash {similarity:.2f})")
+            return dict(_upload_result(existing), duplicate_of=existing, similarity=similarity)
+
+        # Save transcript (UTF-8) + word timings
+        saved = False
         try:
-            with open(os.path.join(TRANSCRIPT_FOLDER, vid + ".txt"), "w", encoding="utf-8", errors="ignore") as fh:
-                fh.write(transcript)
+            save_transcript(vid, data)
+            saved = True
         except Exception as e:
             print("Failed to save transcript:", e)
 
         # ANALYSIS
         try:
-            rawA = nlp_analyzer.analyze_transcript(transcript)
+            rawA = await asyncio.to_thread(nlp_analyzer.analyze_transcript, transcript)
             cleanA = nlp_analyzer.clean_json_output(rawA)
             parsedA = nlp_analyzer.normalize_keys(json.loads(cleanA))
             with open(os.path.join(ANALYSIS_FOLDER, vid + ".json"), "w", encoding="utf-8") as fh:
@@ -273,7 +377,7 @@ async def upload_video(file: UploadFile = File(...), output_type: str = Form(...
 
         # NOTES
         try:
-            rawN = nlp_notes.analyze_notes(transcript)
+            rawN = await asyncio.to_thread(nlp_notes.analyze_notes, transcript)
             cleanN = nlp_analyzer.clean_json_output(rawN)
             parsedN = json.loads(cleanN)
             with open(os.path.join(ANALYSIS_NOTES, vid + ".json"), "w", encoding="utf-8") as fh:
@@ -284,24 +388,36 @@ async def upload_video(file: UploadFile = File(...), output_type: str = Form(...
 
         # Generate PDFs
         try:
-            generate_pdf(parsedA, os.path.join(LIVE_REPORTS, vid + "_analysis.pdf"))
-            generate_notes_pdf(parsedN, os.path.join(LIVE_REPORTS, vid + "_notes.pdf"))
+            await asyncio.to_thread(generate_pdf, parsedA, os.path.join(LIVE_REPORTS, vid + "_analysis.pdf"))
+            await asyncio.to_thread(generate_notes_pdf, parsedN, os.path.join(LIVE_REPORTS, vid + "_notes.pdf"))
         except Exception as e:
             print("PDF generation error:", e)
 
         # Build RAG index for this uploaded video (so it's searchable immediately)
-        try:
-            rag_engine.build_index_for_session(vid)
-            print(f"[RAG] Indexed uploaded video: {vid}")
-        except Exception as e:
-            print("[RAG] Index build error for upload:", e)
+        indexed = False
+        if saved:
+            try:
+                result = await asyncio.to_thread(rag_engine.build_index_for_session, vid)
+                indexed = result.get("status") == "ok"
+                if indexed:
+                    print(f"[RAG] Indexed uploaded video: {vid}")
+                else:
+                    print("[RAG] Index build error for upload:", result.get("error"))
+            except Exception as e:
+                print("[RAG] Index build error for upload:", e)
+
+        # Remember this content for later uploads (only if it is really stored + indexed,
+        # otherwise every later copy would be skipped as a duplicate)
+        if indexed:
+            try:
+                ingest_dedup.register_hash(sha, vid)
+                if signature is not None:
+                    ingest_dedup.register_signature(vid, signature)
+            except Exception as e:
+                print("[DEDUP] Register error:", e)
 
         # Return both links + session id so frontend can index or store if needed
-        return {
-            "analysis": f"http://localhost:8000/live-report/{vid}_analysis",
-            "notes": f"http://localhost:8000/live-report/{vid}_notes",
-            "session_id": vid
-        }
+        return _upload_result(vid)
 
     except Exception as e:
         return {"error": str(e)}
@@ -325,12 +441,61 @@ def get_live_report(session_id: str):
     return {"error": "PDF not found"}
 
 
+# -------------------------------------------------------
+# TRANSCRIPT SEEK (time <-> text via the .npz word store)
+# -------------------------------------------------------
+@app.get("/transcript/{session_id}/seek")
+def transcript_seek(session_id: str, t: Optional[float] = None, q: Optional[str] = None, window: float = 10.0):
+    path = transcript_store.store_path(TRANSCRIPT_FOLDER, session_id)
+    if not os.path.exists(path):
+        return {"error": "No word timings for this session"}
+
+    try:
+        store = transcript_store.TranscriptStore(path)
+
+        if q:
+            span = store.find(q, from_time=t or 0.0)
+            if span is None:
+                return {"found": False}
+            return {"found": True, "start": span[0], "end": span[1]}
+
+        if t is not None:
+            i = store.index_at(t)
+            if i is None:
+                return {"text": ""}
+            return {
+                "word": store.word(i),
+                "start": float(store.start[i]),
+                "end": float(store.end[i]),
+                "text": store.text_between(t, t + window),
+            }
+
+        return {"error": "Pass t (seconds) or q (text)"}
+    except Exception as e:
+        return {"error": str(e)}
+
+
 # -------------------------------------------------------
 # RAG ENDPOINTS (unchanged)
 # -------------------------------------------------------
 class RagQuery(BaseModel):
     question: str
     top_k: int = 5
+    # optional filters: exact sessions, id prefix ("meeting_", "video_"), ingest time (epoch secs)
+    session_ids: Optional[List[str]] = None
+    session_prefix: Optional[str] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+
+class RagBatchQuery(BaseModel):
+    questions: List[str]
+    top_k: int = 5
+    with_answers: bool = False
+    session_ids: Optional[List[str]] = None
+    session_prefix: Optional[str] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
 
 
 @app.post("/rag/store_all")
@@ -356,8 +521,15 @@ def rag_store_one(session_id: str):
 @app.post("/rag/query")
 def rag_query(data: RagQuery):
     try:
-        search_result = rag_engine.search(data.question, data.top_k)
-        answer = rag_engine.rag_ask(data.question, data.top_k)
+        filters = {
+            "session_ids": data.session_ids,
+            "session_prefix": data.session_prefix,
+            "since": data.since,
+            "until": data.until,
+        }
+        # retrieve once, reuse the same hits for the answer prompt
+        search_result = rag_engine.search(data.question, data.top_k, **filters)
+        answer = rag_engine.answer_from_hits(data.question, search_result.get("hits", []))
 
         # ensure wrapper format for frontend compatibility
         results_wrapper = {"hits": search_result.get("hits", [])} if isinstance(search_result, dict) else search_result
@@ -369,3 +541,76 @@ def rag_query(data: RagQuery):
     except Exception as e:
         print("[RAG ERROR query]:", e)
         return {"error": str(e)}
+
+
+@app.get("/rag/cache_stats")
+def rag_cache_stats():
+    return rag_engine.cache_stats()
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.post("/rag/query_stream")
+def rag_query_stream(data: RagQuery):
+    """
+    Server-Sent Events version of /rag/query:
+      event: hits   -> {"hits": [...]} (sent as soon as retrieval is done)
+      event: token  -> "answer text piece"
+      event: done   -> {"answer": "full answer"}
+      event: error  -> "message"
+    """
+    def events():
+        try:
+            search_result = rag_engine.search(
+                data.question, data.top_k,
+                session_ids=data.session_ids,
+                session_prefix=data.session_prefix,
+                since=data.since,
+                until=data.until,
+            )
+            hits = search_result.get("hits", [])
+            yield _sse("hits", {"hits": hits})
+
+            answer = []
+            for piece in rag_engine.stream_answer_from_hits(data.question, hits):
+                answer.append(piece)
+                yield _sse("token", piece)
+
+            yield _sse("done", {"answer": "".join(answer).strip()})
+        except Exception as e:
+            print("[RAG ERROR query_stream]:", e)
+            yield _sse("error", str(e))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/rag/query_batch")
+def rag_query_batch(data: RagBatchQuery):
+    try:
+        search_results = rag_engine.search_batch(
+            data.questions, data.top_k,
+            session_ids=data.session_ids,
+            session_prefix=data.session_prefix,
+            since=data.since,
+            until=data.until,
+        )
+
+        answers = [None] * len(data.questions)
+        if data.with_answers:
+            answers = rag_engine.answer_batch(data.questions, [r["hits"] for r in search_results])
+
+        return {
+            "results": [
+                {"question": q, "results": r, "answer": a}
+                for q, r, a in zip(data.questions, search_results, answers)
+            ]
+        }
+    except Exception as e:
+        print("[RAG ERROR query_batch]:", e)
+        return {"error": str(e)}
@@ -0,0 +1,320 @@
+"""
+Shared gateway for every Groq call (chat LLMs and Whisper).
+
+- one pooled sync client and one async client for the whole process
+- per-model concurrency semaphores (MODEL_LIMITS)
+- request timeouts, retries with exponential backoff + jitter on 429 /
+  5xx / timeouts (Retry-After is honoured)
+- optional hedging for short non-streaming chat calls: if the first request
+  is slower than the model's observed p95, a second one is sent (only if a
+  slot is free) and the first answer wins
+- per-model latency / error / retry / hedge metrics (metrics())
+
+Limits are per server process: with `uvicorn --workers N` up to N times
+each model's limit is in flight against Groq, so set the LLM_WORKER_*
+variables to the account's budget divided by the worker count. Metrics are
+per process as well.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait, FIRST_COMPLETED
+
+import httpx
+import groq
+from groq import Groq, AsyncGroq
+
+from config import GROQ_API_KEY
+
+# ----------------------------
+# SETTINGS
+# ----------------------------
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))               # HTTP connections per client
+# concurrent requests per model, per worker process (see module docstring)
+DEFAULT_LIMIT = int(os.getenv("LLM_WORKER_DEFAULT_CONCURRENCY", "8"))
+MODEL_LIMITS = {
+    "whisper-large-v3": int(os.getenv("LLM_WORKER_LIMIT_WHISPER", "4")),
+    "qwen/qwen3-32b": int(os.getenv("LLM_WORKER_LIMIT_QWEN", "8")),
+    "llama-3.1-8b-instant": int(os.getenv("LLM_WORKER_LIMIT_LLAMA", "16")),
+}
+
+CHAT_TIMEOUT = float(os.getenv("LLM_CHAT_TIMEOUT", "60"))
+AUDIO_TIMEOUT = float(os.getenv("LLM_AUDIO_TIMEOUT", "300"))
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE = 0.5        # seconds, doubled per attempt
+BACKOFF_MAX = 20.0
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "1") != "0"
+HEDGE_DEFAULT_AFTER = 3.0   # seconds, until enough latency samples exist
+HEDGE_MIN_SAMPLES = 20
+
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+# ----------------------------
+# CLIENTS
+# ----------------------------
+_limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+
+# SDK-level retries are off: retries/backoff happen here, per model
+client = Groq(
+    api_key=GROQ_API_KEY or "",
+    max_retries=0,
+    timeout=CHAT_TIMEOUT,
+    http_client=httpx.Client(limits=_limits),
+)
+async_client = AsyncGroq(
+    api_key=GROQ_API_KEY or "",
+    max_retries=0,
+    timeout=CHAT_TIMEOUT,
+    http_client=httpx.AsyncClient(limits=_limits),
+)
+
+_pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="llm")
+
+# ----------------------------
+# LIMITS + METRICS
+# ----------------------------
+_lock = threading.Lock()
+_sync_sems = {}
+_async_sems = {}
+_metrics = {}
+
+
+def _limit(model):
+    return MODEL_LIMITS.get(model, DEFAULT_LIMIT)
+
+
+def _sync_sem(model):
+    with _lock:
+        if model not in _sync_sems:
+            _sync_sems[model] = threading.BoundedSemaphore(_limit(model))
+        return _sync_sems[model]
+
+
+def _async_sem(model):
+    with _lock:
+        if model not in _async_sems:
+            _async_sems[model] = asyncio.Semaphore(_limit(model))
+        return _async_sems[model]
+
+
+def _m(model):
+    with _lock:
+        if model not in _metrics:
+            _metrics[model] = {
+                "calls": 0, "errors": 0, "retries": 0, "hedges": 0, "in_flight": 0,
+                "latency": deque(maxlen=1000), "ttft": deque(maxlen=1000),
+            }
+        return _metrics[model]
+
+
+def _bump(model, key, n=1):
+    m = _m(model)
+    with _lock:
+        m[key] += n
+
+
+def _record(model, seconds, ok, key="latency"):
+    m = _m(model)
+    with _lock:
+        m["calls"] += 1
+        if not ok:
+            m["errors"] += 1
+        m[key].append(seconds)
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100.0 * len(values)))], 4)
+
+
+def metrics():
+    out = {}
+    with _lock:
+        items = [(k, dict(v, latency=list(v["latency"]), ttft=list(v["ttft"]))) for k, v in _metrics.items()]
+    for model, m in items:
+        out[model] = {
+            "calls": m["calls"],
+            "errors": m["errors"],
+            "error_rate": round(m["errors"] / m["calls"], 4) if m["calls"] else 0.0,
+            "retries": m["retries"],
+            "hedges": m["hedges"],
+            "in_flight": m["in_flight"],
+            "concurrency_limit": _limit(model),    # this worker's share
+            "p50": _percentile(m["latency"], 50),
+            "p95": _percentile(m["latency"], 95),
+            "p99": _percentile(m["latency"], 99),
+            "ttft_p50": _percentile(m["ttft"], 50),
+        }
+    return out
+
+
+# ----------------------------
+# RETRIES
+# ----------------------------
+def _retryable(e):
+    if isinstance(e, (groq.RateLimitError, groq.APITimeoutError, groq.APIConnectionError, groq.InternalServerError)):
+        return True
+    return isinstance(e, groq.APIStatusError) and e.status_code in RETRY_STATUS
+
+
+def _backoff(e, attempt):
+    try:
+        retry_after = float(e.response.headers.get("retry-after"))
+        return min(retry_after, BACKOFF_MAX)
+    except Exception:
+        pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _with_retries(model, fn):
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not _retryable(e):
+                raise
+            _bump(model, "retries")
+            time.sleep(_backoff(e, attempt))
+            attempt += 1
+
+
+# ----------------------------
+# SYNC CALLS
+# ----------------------------
+def _run_holding(model, sem, fn):
+    """Run fn while holding an already-acquired slot of sem; record latency."""
+    _bump(model, "in_flight")
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        res = fn()
+        ok = True
+        return res
+    finally:
+        _record(model, time.perf_counter() - t0, ok)
+        _bump(model, "in_flight", -1)
+        sem.release()
+
+
+def _limited(model, fn):
+    sem = _sync_sem(model)
+    sem.acquire()
+    return _run_holding(model, sem, fn)
+
+
+def _hedge_after(model):
+    m = _m(model)
+    with _lock:
+        lat = list(m["latency"])
+    if len(lat) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_AFTER
+    return _percentile(lat, 95)
+
+
+def _hedged(model, fn):
+    sem = _sync_sem(model)
+    sem.acquire()
+    primary = _pool.submit(_run_holding, model, sem, fn)
+    try:
+        return primary.result(timeout=_hedge_after(model))
+    except FuturesTimeout:
+        pass
+
+    # only hedge when it does not push the model over its concurrency limit
+    if not sem.acquire(blocking=False):
+        return primary.result()
+
+    _bump(model, "hedges")
+    backup = _pool.submit(_run_holding, model, sem, fn)
+    done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+    first = done.pop()
+    if first.exception() is None:
+        return first.result()
+    return (backup if first is primary else primary).result()
+
+
+def chat(model, messages, hedge=False, timeout=CHAT_TIMEOUT, **kwargs):
+    """
+    chat.completions.create through the gateway (non-streaming).
+    hedge=True is meant for short, latency-sensitive calls; long generations
+    would mostly just double their cost.
+    """
+    def once():
+        return client.chat.completions.create(model=model, messages=messages, timeout=timeout, **kwargs)
+
+    if hedge and HEDGE_ENABLED:
+        return _with_retries(model, lambda: _hedged(model, once))
+    return _with_retries(model, lambda: _limited(model, once))
+
+
+def chat_stream(model, messages, timeout=CHAT_TIMEOUT, **kwargs):
+    """Streaming chat: yields SDK chunks. Retries only cover opening the stream."""
+    sem = _sync_sem(model)
+    sem.acquire()
+    _bump(model, "in_flight")
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        stream = _with_retries(model, lambda: client.chat.completions.create(
+            model=model, messages=messages, stream=True, timeout=timeout, **kwargs
+        ))
+        first = True
+        for part in stream:
+            if first:
+                m = _m(model)
+                with _lock:
+                    m["ttft"].append(time.perf_counter() - t0)
+                first = False
+            yield part
+        ok = True
+    finally:
+        _record(model, time.perf_counter() - t0, ok)
+        _bump(model, "in_flight", -1)
+        sem.release()
+
+
+def transcribe(path, model="whisper-large-v3", timeout=AUDIO_TIMEOUT, **kwargs):
+    """audio.transcriptions.create for a file on disk (reopened on every retry)."""
+    def once():
+        with open(path, "rb") as f:
+            return client.audio.transcriptions.create(file=f, model=model, timeout=timeout, **kwargs)
+
+    return _with_retries(model, lambda: _limited(model, once))
+
+
+# ----------------------------
+# ASYNC CALLS
+# ----------------------------
+async def achat(model, messages, timeout=CHAT_TIMEOUT, **kwargs):
+    """Async chat.completions.create with the same limits, retries and metrics."""
+    attempt = 0
+    while True:
+        sem = _async_sem(model)
+        async with sem:
+            _bump(model, "in_flight")
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                res = await async_client.chat.completions.create(
+                    model=model, messages=messages, timeout=timeout, **kwargs
+                )
+                ok = True
+                return res
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not _retryable(e):
+                    raise
+                _bump(model, "retries")
+                delay = _backoff(e, attempt)
+            finally:
+                _record(model, time.perf_counter() - t0, ok)
+                _bump(model, "in_flight", -1)
+        await asyncio.sleep(delay)
+        attempt += 1
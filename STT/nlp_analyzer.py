@@ -1,9 +1,7 @@
-from groq import Groq
-import os
 import json
 import re
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY", ""))
+import llm_gateway
 
 
 def clean_json_output(raw):
@@ -52,7 +50,7 @@ Return EXACT JSON with these keys only:
 }}
 """
 
-    response = client.chat.completions.create(
+    response = llm_gateway.chat(
         model="qwen/qwen3-32b",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.25
@@ -1,7 +1,4 @@
-from groq import Groq
-import os
-
-client = Groq(api_key=os.getenv("GROQ_API_KEY", ""))
+import llm_gateway
 
 def analyze_notes(transcript):
 
@@ -31,7 +28,7 @@ Return EXACT JSON:
 }}
 """
 
-    resp = client.chat.completions.create(
+    resp = llm_gateway.chat(
         model="qwen/qwen3-32b",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3
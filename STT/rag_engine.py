@@ -1,9 +1,18 @@
 import os
 import json
+import math
+import bisect
+import itertools
+import unicodedata
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from groq import Groq
+
+from file_lock import file_lock, atomic_write_json
+from rag_cache import TTLCache, normalize_query
+import transcript_store
+import llm_gateway
 
 # ----------------------------
 # GLOBALS
@@ -11,138 +20,767 @@ from groq import Groq
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TRANSCRIPT_FOLDER = os.path.join(BASE_DIR, "transcripts")
 INDEX_FILE = os.path.join(BASE_DIR, "rag_index.json")
-
-client = Groq(api_key=os.getenv("GROQ_API_KEY", ""))
+LOCK_FILE = INDEX_FILE + ".lock"
+
+NO_ANSWER = "The answer is not available in the provided transcripts."
+QUERY_BLOCK = 256      # questions scored per matrix product in search_batch
+EMBED_BATCH = 32       # chunks per embedder.encode call while indexing
+ANSWER_WORKERS = 8     # concurrent LLM calls in answer_batch
+
+# chunking
+CHUNK_MAX_WORDS = 120
+CHUNK_OVERLAP = 20            # words repeated at the start of the next chunk
+SENTENCE_END = (".", "?", "!", "\u0964", "\u0965")   # incl. Devanagari danda
+ALIGN_LOOKAHEAD = 2000        # chars of transcript text searched for the next timed word
+
+# context assembly for the answer prompt
+CONTEXT_TOKEN_BUDGET = 1200   # hard cap on (estimated) context tokens
+MMR_LAMBDA = 0.7              # relevance vs. diversity trade-off
+DUPLICATE_SIM = 0.95          # chunks this similar to a picked one are dropped
+
+# layered caches: query -> embedding, (query, filters, generation) -> hits,
+# (question, hit chunk ids) -> answer. Hits/answers are dropped on a new generation.
+embedding_cache = TTLCache(maxsize=4096)
+hits_cache = TTLCache(maxsize=2048, ttl=3600)
+answer_cache = TTLCache(maxsize=1024, ttl=3600)
+_cache_generation = None
 
 # ⭐ Multilingual embedding model (Hindi + English understanding)
 embedder = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
 
 
+# ----------------------------
+# INDEX WRITE LOCK (one writer across all workers)
+# ----------------------------
+def index_write_lock():
+    """Exclusive, re-entrant (per thread) lock for read-modify-write of the index."""
+    return file_lock(LOCK_FILE)
+
+
 # ----------------------------
 # LOAD / SAVE INDEX
 # ----------------------------
 def load_index():
     if not os.path.exists(INDEX_FILE):
-        return {"documents": []}
-    return json.load(open(INDEX_FILE, "r", encoding="utf-8"))
+        return {"generation": 0, "documents": []}
+    with open(INDEX_FILE, "r", encoding="utf-8") as fh:
+        index = json.load(fh)
+    index.setdefault("generation", 0)
+    return index
+
+
+def commit_index(update):
+    """
+    Read-modify-write of the index as one commit: under the write lock, pass
+    the committed documents to update() and write its result as the next
+    generation (temp file + atomic rename). The generation is taken from the
+    committed index itself, so it only ever moves forward.
+    """
+    with index_write_lock():
+        current = load_index()
+        documents = update(current["documents"])
+        index = {"generation": current["generation"] + 1, "documents": documents}
+        atomic_write_json(INDEX_FILE, index, indent=4)
+    return index["generation"]
 
 
 def save_index(index):
-    json.dump(index, open(INDEX_FILE, "w", encoding="utf-8"),
-              indent=4, ensure_ascii=False)
+    """Replace the whole index with index["documents"] (one new generation)."""
+    return commit_index(lambda _: index["documents"])
+
+
+# ----------------------------
+# READ SNAPSHOT (hot reload in every worker)
+# ----------------------------
+_snapshot = None
+_snapshot_sig = None
+_reload_lock = threading.Lock()
+
+
+def _index_signature():
+    try:
+        st = os.stat(INDEX_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _build_snapshot(index):
+    # stable sort -> every session is one contiguous partition, chunk order kept
+    docs = sorted(index["documents"], key=lambda d: d["session_id"])
+    emb = np.array([d["embedding"] for d in docs], dtype=np.float32) if docs else None
+    if emb is not None:
+        # unit rows -> cosine similarity is a plain dot product at query time
+        norms = np.linalg.norm(emb, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        emb /= norms
+    ingested = np.array([d.get("ingested_at", 0.0) for d in docs], dtype=np.float64)
+
+    # session_id -> (start, end) row offsets, (session_id, chunk_id) -> row
+    partitions = {}
+    row_of = {}
+    for i, d in enumerate(docs):
+        start, _ = partitions.get(d["session_id"], (i, i))
+        partitions[d["session_id"]] = (start, i + 1)
+        row_of[(d["session_id"], d["chunk_id"])] = i
+
+    return {
+        "generation": index.get("generation", 0),
+        "documents": docs,
+        "embeddings": emb,
+        "ingested_at": ingested,
+        "partitions": partitions,
+        "session_keys": sorted(partitions),
+        "row_of": row_of,
+    }
+
+
+def get_snapshot():
+    """
+    Return the current read-only index snapshot.
+
+    Commits replace the file by rename, so a changed inode/mtime means a new
+    generation. One thread reloads it while the others keep querying the old
+    snapshot; the swap is a single reference assignment.
+    """
+    global _snapshot, _snapshot_sig
+
+    sig = _index_signature()
+    if _snapshot is not None and sig == _snapshot_sig:
+        return _snapshot
+
+    # someone else is already reloading -> serve the previous snapshot
+    if not _reload_lock.acquire(blocking=_snapshot is None):
+        return _snapshot
+
+    try:
+        sig = _index_signature()
+        if _snapshot is None or sig != _snapshot_sig:
+            _snapshot = _build_snapshot(load_index())
+            _snapshot_sig = sig
+        return _snapshot
+    finally:
+        _reload_lock.release()
 
 
 # ----------------------------
 # CHUNKING
 # ----------------------------
-def chunk_text(text, max_words=120):
-    words = text.split()
-    chunks = []
-    i = 0
-    while i < len(words):
-        chunk = " ".join(words[i:i + max_words])
-        chunks.append(chunk)
-        i += max_words
-    return chunks
+def _iter_timed_words(session_id):
+    """(word, start, end) from the .npz store or verbose_json, or None without word timings."""
+    npz_path = transcript_store.store_path(TRANSCRIPT_FOLDER, session_id)
+    if os.path.exists(npz_path):
+        store = transcript_store.TranscriptStore(npz_path)
+        if len(store):
+            return store.iter_words()
+
+    json_path = os.path.join(TRANSCRIPT_FOLDER, f"{session_id}.json")
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, "r", encoding="utf-8") as fh:
+                words = json.load(fh).get("words") or []
+        except ValueError:
+            words = []
+        if words:
+            return ((str(w.get("word", "")).strip(), w.get("start"), w.get("end"))
+                    for w in words if str(w.get("word", "")).strip())
+
+    return None
+
+
+def _find_word(buf, token, cursor):
+    end = cursor + ALIGN_LOOKAHEAD
+    pos = buf.find(token, cursor, end)
+    if pos < 0:
+        pos = buf[cursor:end].lower().find(token.lower())
+        if pos >= 0:
+            pos += cursor
+    return pos
+
+
+def _align_to_text(timed_words, fh, block_size):
+    """
+    Whisper word tokens usually carry no punctuation. Find each token in the
+    transcript text (read in blocks, only a small window kept) and yield its
+    surface form there, including trailing punctuation, with the token's times.
+    Tokens that cannot be found nearby are yielded as they are.
+    """
+    buf = ""
+    cursor = 0
+    eof = False
+
+    for token, start, end in timed_words:
+        while not eof and len(buf) - cursor < ALIGN_LOOKAHEAD:
+            block = fh.read(block_size)
+            if not block:
+                eof = True
+            buf += block
+
+        pos = _find_word(buf, token, cursor)
+        if pos < 0:
+            yield (token, start, end)
+            continue
+
+        stop = pos + len(token)
+        while stop < len(buf) and unicodedata.category(buf[stop]).startswith("P"):
+            stop += 1
+        yield (buf[pos:stop], start, end)
+
+        cursor = stop
+        if cursor > block_size:
+            buf, cursor = buf[cursor:], 0
+
+
+def iter_session_words(session_id, block_size=65536):
+    """
+    Yield (word, start, end) for a session transcript.
+
+    Timings come from the compact <session_id>.npz store or <session_id>.json
+    (verbose_json); the words themselves (with punctuation) are taken from the
+    .txt and aligned to those timings. Without timings the .txt is streamed in
+    blocks with start/end = None.
+    """
+    txt_path = os.path.join(TRANSCRIPT_FOLDER, f"{session_id}.txt")
+    timed = _iter_timed_words(session_id)
+
+    with open(txt_path, "r", encoding="utf-8") as fh:
+        if timed is not None:
+            yield from _align_to_text(timed, fh, block_size)
+            return
+
+        tail = ""
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            parts = (tail + block).split()
+            # a word may continue in the next block
+            tail = "" if block[-1].isspace() or not parts else parts.pop()
+            for w in parts:
+                yield (w, None, None)
+        if tail:
+            yield (tail, None, None)
+
+
+def _is_sentence_end(word):
+    return word.rstrip("\"'\u201d\u2019)]").endswith(SENTENCE_END)
+
+
+def _iter_sentences(words):
+    sentence = []
+    for w in words:
+        sentence.append(w)
+        if _is_sentence_end(w[0]):
+            yield sentence
+            sentence = []
+    if sentence:
+        yield sentence
+
+
+def _make_chunk(window, word_start):
+    flat = [w for sentence in window for w in sentence]
+    starts = [w[1] for w in flat if w[1] is not None]
+    ends = [w[2] for w in flat if w[2] is not None]
+    return {
+        "chunk": " ".join(w[0] for w in flat),
+        "start": starts[0] if starts else None,
+        "end": ends[-1] if ends else None,
+        "word_start": word_start,
+        "word_end": word_start + len(flat),
+    }
+
+
+def _trim_front(window, keep_words):
+    """Drop words from the front of window until at most keep_words remain; returns words dropped."""
+    n = sum(len(s) for s in window)
+    drop = max(0, n - keep_words)
+    dropped = drop
+    while drop and window:
+        if len(window[0]) <= drop:
+            drop -= len(window.pop(0))
+        else:
+            window[0] = window[0][drop:]
+            drop = 0
+    return dropped
+
+
+def iter_chunks(words, max_words=CHUNK_MAX_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Group (word, start, end) tuples into chunks of whole sentences, at most
+    max_words long. Each chunk starts with the trailing sentences (up to
+    `overlap` words) of the previous one. Sentences longer than
+    max_words - overlap (e.g. unpunctuated ASR text) are cut into pieces of
+    that size, so the overlap still fits in front of them. Works as a
+    generator: only the current window is kept in memory.
+    """
+    overlap = min(overlap, max_words - 1)
+    piece_words = max_words - overlap
+
+    window = []       # list of sentences (lists of word tuples)
+    n = 0             # words in window
+    pos = 0           # absolute index of the window's first word
+    fresh = False     # window has words not yet emitted
+
+    for sentence in _iter_sentences(words):
+        for i in range(0, len(sentence), piece_words):
+            piece = sentence[i:i + piece_words]
+
+            if n + len(piece) > max_words and fresh:
+                yield _make_chunk(window, pos)
+
+                keep, kept = [], 0
+                for s in reversed(window):
+                    if kept + len(s) > overlap:
+                        break
+                    keep.insert(0, s)
+                    kept += len(s)
+                if not keep and overlap > 0:
+                    keep = [window[-1][-overlap:]]
+                    kept = len(keep[0])
+
+                pos += n - kept
+                window, n, fresh = keep, kept, False
+
+            if n + len(piece) > max_words:
+                # shorten the carried-over overlap so this piece still fits
+                dropped = _trim_front(window, max_words - len(piece))
+                pos += dropped
+                n -= dropped
+
+            window.append(piece)
+            n += len(piece)
+            fresh = True
+
+    if fresh:
+        yield _make_chunk(window, pos)
 
 
 # ----------------------------
 # BUILD INDEX FOR ONE SESSION
 # ----------------------------
-def build_index_for_session(session_id):
-    index = load_index()
-
+def _embed_session(session_id):
+    """Chunk + embed one transcript (no lock held). Returns (entries, error)."""
     txt_path = os.path.join(TRANSCRIPT_FOLDER, f"{session_id}.txt")
     if not os.path.exists(txt_path):
-        return {"error": f"Transcript not found: {session_id}"}
+        return None, f"Transcript not found: {session_id}"
 
-    text = open(txt_path, "r", encoding="utf-8").read().strip()
-    chunks = chunk_text(text)
+    chunks = iter_chunks(iter_session_words(session_id))
+
+    # first indexing: when the transcript was written (_replace_session keeps older stamps)
+    ingested_at = os.path.getmtime(txt_path)
+    entries = []
+    try:
+        while True:
+            batch = list(itertools.islice(chunks, EMBED_BATCH))
+            if not batch:
+                break
+            vecs = embedder.encode([c["chunk"] for c in batch])
+            for c, vec in zip(batch, vecs):
+                entry = {
+                    "session_id": session_id,
+                    "chunk_id": len(entries),
+                    "chunk": c["chunk"],
+                    "start": c["start"],
+                    "end": c["end"],
+                    "word_start": c["word_start"],
+                    "word_end": c["word_end"],
+                    "ingested_at": ingested_at,
+                    "embedding": vec.tolist()
+                }
+                entries.append(entry)
+    except Exception as e:
+        return None, str(e)
+
+    return entries, None
+
+
+def _earliest_ingested(docs):
+    """{session_id: earliest ingested_at} over docs."""
+    first = {}
+    for d in docs:
+        t = d.get("ingested_at")
+        if t is not None:
+            first[d["session_id"]] = min(t, first.get(d["session_id"], t))
+    return first
+
+
+def _keep_ingested_at(entries, first):
+    # a re-index keeps the session's earliest ingested_at, so it does not move
+    # an old session into a newer since/until window
+    if first is not None:
+        for e in entries:
+            e["ingested_at"] = min(e["ingested_at"], first)
 
-    for i, c in enumerate(chunks):
-        try:
-            vec = embedder.encode([c])[0].tolist()
-            entry = {
-                "session_id": session_id,
-                "chunk_id": i,
-                "chunk": c,
-                "embedding": vec
-            }
-            index["documents"].append(entry)
-        except Exception as e:
-            return {"error": str(e)}
 
-    save_index(index)
-    return {"status": "ok", "chunks": len(chunks)}
+def _replace_session(docs, session_id, entries):
+    """docs with session_id's chunks swapped for entries (earliest ingested_at kept)."""
+    _keep_ingested_at(entries, _earliest_ingested(d for d in docs if d["session_id"] == session_id).get(session_id))
+    return [d for d in docs if d["session_id"] != session_id] + entries
+
+
+def build_index_for_session(session_id):
+    # embed outside the write lock so other workers are not held up
+    entries, error = _embed_session(session_id)
+    if error:
+        return {"error": error}
+
+    # re-indexing a session replaces its chunks instead of duplicating them
+    commit_index(lambda docs: _replace_session(docs, session_id, entries))
+
+    return {"status": "ok", "chunks": len(entries)}
 
 
 # ----------------------------
 # BUILD INDEX FOR ALL SESSIONS
 # ----------------------------
 def build_index_from_all():
-    save_index({"documents": []})  # RESET INDEX
-
     files = [f for f in os.listdir(TRANSCRIPT_FOLDER) if f.endswith(".txt")]
     output = {}
+    rebuilt = {}
+    failed = set()
 
+    # embed everything first, without the lock; readers keep the old index meanwhile
     for f in files:
         session_id = f.replace(".txt", "")
-        res = build_index_for_session(session_id)
-        output[session_id] = res
+        entries, error = _embed_session(session_id)
+        if error:
+            failed.add(session_id)
+            output[session_id] = {"error": error}
+        else:
+            rebuilt[session_id] = entries
+            output[session_id] = {"status": "ok", "chunks": len(entries)}
+
+    def rebuild(docs):
+        first = _earliest_ingested(docs)
+        # sessions that failed to re-embed keep their current chunks
+        kept = [d for d in docs if d["session_id"] in failed]
+        for session_id, entries in rebuilt.items():
+            _keep_ingested_at(entries, first.get(session_id))
+            kept.extend(entries)
+        return kept
+
+    # one commit -> workers swap from the old complete index to the new one
+    commit_index(rebuild)
 
     return {"status": "ok", "data": output}
 
 
 # ----------------------------
-# SEARCH FUNCTION
+# METADATA FILTERS
 # ----------------------------
-def search(query, top_k=5, min_score=0.35):
-    index = load_index()
-    docs = index["documents"]
-
-    if not docs:
-        return {"hits": []}
+def _select_rows(snap, session_ids=None, session_prefix=None, since=None, until=None):
+    """
+    Resolve filters to the row indices that must be scored.
+
+    Returns None when nothing is filtered (score the whole matrix). Session
+    filters are resolved through the partition table, so only the matching
+    sessions' rows are touched; the time range is then applied to those rows.
+    """
+    if not session_ids and not session_prefix and since is None and until is None:
+        return None
+
+    parts = snap["partitions"]
+
+    if session_ids or session_prefix:
+        if session_prefix:
+            keys = snap["session_keys"]
+            lo = bisect.bisect_left(keys, session_prefix)
+            hi = bisect.bisect_left(keys, session_prefix + "\uffff")
+            wanted = keys[lo:hi]
+            if session_ids:
+                wanted = [sid for sid in wanted if sid in session_ids]
+        else:
+            wanted = [sid for sid in dict.fromkeys(session_ids) if sid in parts]
+
+        ranges = [parts[sid] for sid in wanted]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate([np.arange(a, b) for a, b in ranges])
+    else:
+        rows = np.arange(len(snap["documents"]))
+
+    if since is not None or until is not None:
+        ts = snap["ingested_at"][rows]
+        keep = np.ones(len(rows), dtype=bool)
+        if since is not None:
+            keep &= ts >= since
+        if until is not None:
+            keep &= ts <= until
+        rows = rows[keep]
+
+    return rows
 
-    q_vec = embedder.encode([query])[0].reshape(1, -1)
-    all_emb = np.array([d["embedding"] for d in docs])
 
-    scores = cosine_similarity(q_vec, all_emb)[0]
-    sorted_idx = np.argsort(scores)[::-1]
+# ----------------------------
+# SEARCH FUNCTION
+# ----------------------------
+def _encode_queries(queries):
+    """Unit-length query vectors; only queries missing from embedding_cache are encoded."""
+    vecs = {}
+    missing = []
+    for q in dict.fromkeys(queries):
+        v = embedding_cache.get(q)
+        if v is None:
+            missing.append(q)
+        else:
+            vecs[q] = v
+
+    if missing:
+        enc = np.asarray(embedder.encode(missing), dtype=np.float32)
+        norms = np.linalg.norm(enc, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        enc /= norms
+        for q, v in zip(missing, enc):
+            embedding_cache.set(q, v)
+            vecs[q] = v
+
+    return np.stack([vecs[q] for q in queries])
+
+
+def _sync_cache_generation(generation):
+    global _cache_generation
+    if generation != _cache_generation:
+        hits_cache.clear()
+        answer_cache.clear()
+        _cache_generation = generation
+
+
+def cache_stats():
+    return {
+        "generation": _cache_generation,
+        "embeddings": embedding_cache.stats(),
+        "hits": hits_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
+
+
+def _hits_from_scores(docs, scores, rows, top_k, min_score):
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return []
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
 
     hits = []
-    for idx in sorted_idx:
+    for idx in top:
         if scores[idx] < min_score:
-            continue
+            break
 
-        d = docs[idx]
+        d = docs[idx if rows is None else rows[idx]]
         hits.append({
             "chunk": d["chunk"],
             "meta": {
                 "session_id": d["session_id"],
-                "chunk_id": d["chunk_id"]
+                "chunk_id": d["chunk_id"],
+                "start": d.get("start"),
+                "end": d.get("end"),
+                "word_start": d.get("word_start"),
+                "word_end": d.get("word_end"),
+                "ingested_at": d.get("ingested_at")
             },
             "score": float(scores[idx])
         })
 
-        if len(hits) == top_k:
-            break
+    return hits
+
+
+def search_batch(queries, top_k=5, min_score=0.35,
+                 session_ids=None, session_prefix=None, since=None, until=None):
+    """
+    Score many queries at once: one encode call, then one matrix-matrix
+    product per block of QUERY_BLOCK questions. Returns one {"hits": [...]}
+    per query, in order.
+    """
+    queries = list(queries)
+    snap = get_snapshot()
+    docs = snap["documents"]
+
+    if not queries:
+        return []
+    if not docs:
+        return [{"hits": []} for _ in queries]
+
+    rows = _select_rows(snap, session_ids, session_prefix, since, until)
+    if rows is not None and len(rows) == 0:
+        return [{"hits": []} for _ in queries]
+
+    generation = snap["generation"]
+    _sync_cache_generation(generation)
+    filter_key = (tuple(sorted(session_ids)) if session_ids else None, session_prefix, since, until)
+
+    norm = [normalize_query(q) for q in queries]
+    keys = [(q, top_k, min_score, filter_key, generation) for q in norm]
+
+    results = [None] * len(queries)
+    pending = []
+    for i, key in enumerate(keys):
+        cached = hits_cache.get(key)
+        if cached is None:
+            pending.append(i)
+        else:
+            results[i] = {"hits": cached}
 
-    return {"hits": hits}
+    if not pending:
+        return results
+
+    all_emb = snap["embeddings"] if rows is None else snap["embeddings"][rows]
+    q_vecs = _encode_queries([norm[i] for i in pending])
+
+    for start in range(0, len(pending), QUERY_BLOCK):
+        scores = q_vecs[start:start + QUERY_BLOCK] @ all_emb.T
+        for i, row_scores in zip(pending[start:start + QUERY_BLOCK], scores):
+            hits = _hits_from_scores(docs, row_scores, rows, top_k, min_score)
+            hits_cache.set(keys[i], hits)
+            results[i] = {"hits": hits}
+
+    return results
+
+
+def search(query, top_k=5, min_score=0.35,
+           session_ids=None, session_prefix=None, since=None, until=None):
+    return search_batch([query], top_k, min_score,
+                        session_ids=session_ids, session_prefix=session_prefix,
+                        since=since, until=until)[0]
 
 
 # ----------------------------
 # RAG ANSWER GENERATOR
 # ----------------------------
-def rag_ask(question, top_k=5):
-    hits = search(question, top_k)["hits"]
+def rag_ask(question, top_k=5,
+            session_ids=None, session_prefix=None, since=None, until=None):
+    hits = search(question, top_k,
+                  session_ids=session_ids, session_prefix=session_prefix,
+                  since=since, until=until)["hits"]
+    return answer_from_hits(question, hits)
+
+
+def answer_batch(questions, hits_list, max_workers=ANSWER_WORKERS):
+    """Generate answers for already-retrieved hits, LLM calls run concurrently."""
+    if not questions:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(questions))) as pool:
+        return list(pool.map(answer_from_hits, questions, hits_list))
+
+
+# ----------------------------
+# CONTEXT ASSEMBLY
+# ----------------------------
+def estimate_tokens(text):
+    # rough: ~3 chars per token keeps Hindi/Hinglish on the safe side
+    return math.ceil(len(text) / 3)
 
+
+def _truncate_to_tokens(text, budget):
+    words = text.split()
+    out = []
+    used = 0
+    for w in words:
+        used += estimate_tokens(w + " ")
+        if used > budget:
+            break
+        out.append(w)
+    return " ".join(out)
+
+
+def _mmr_select(hits, budget):
+    """
+    Greedy MMR over the hits' index embeddings: pick by
+    MMR_LAMBDA * score - (1 - MMR_LAMBDA) * max similarity to already picked,
+    drop near-duplicates, and stop adding once the token budget is used.
+    """
+    snap = get_snapshot()
+    rows = [snap["row_of"].get((h["meta"]["session_id"], h["meta"]["chunk_id"])) for h in hits]
+    emb = snap["embeddings"]
+
+    picked = []
+    picked_vecs = []
+    used = 0
+    remaining = list(range(len(hits)))
+
+    while remaining:
+        best, best_val, best_sim = None, None, 0.0
+        for i in remaining:
+            sim = 0.0
+            if picked_vecs and rows[i] is not None:
+                sim = float(np.max(np.stack(picked_vecs) @ emb[rows[i]]))
+            val = MMR_LAMBDA * hits[i]["score"] - (1 - MMR_LAMBDA) * sim
+            if best_val is None or val > best_val:
+                best, best_val, best_sim = i, val, sim
+        remaining.remove(best)
+
+        if best_sim >= DUPLICATE_SIM:
+            continue
+
+        cost = estimate_tokens(hits[best]["chunk"])
+        if used + cost > budget:
+            continue
+
+        picked.append(best)
+        used += cost
+        if rows[best] is not None:
+            picked_vecs.append(emb[rows[best]])
+
+    if not picked and hits:
+        # a single chunk larger than the whole budget: keep its head
+        top = dict(hits[0], chunk=_truncate_to_tokens(hits[0]["chunk"], budget))
+        return [top]
+
+    return [hits[i] for i in picked]
+
+
+def build_context(hits, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Turn retrieved hits into prompt context: MMR diversity selection, then
+    merge chunks that are adjacent in the same session into one passage.
+    Passages are ordered by their best hit score. budget=None keeps the
+    old behaviour (plain join of every hit).
+    """
+    if budget is None:
+        return "\n\n".join([h["chunk"] for h in hits])
+
+    selected = _mmr_select(hits, budget)
+
+    by_session = {}
+    for h in selected:
+        by_session.setdefault(h["meta"]["session_id"], []).append(h)
+
+    passages = []
+    for group in by_session.values():
+        group.sort(key=lambda h: h["meta"]["chunk_id"])
+        run = [group[0]]
+        for h in group[1:]:
+            if h["meta"]["chunk_id"] == run[-1]["meta"]["chunk_id"] + 1:
+                run.append(h)
+            else:
+                passages.append(run)
+                run = [h]
+        passages.append(run)
+
+    passages.sort(key=lambda run: max(h["score"] for h in run), reverse=True)
+    return "\n\n".join(_merge_run(run) for run in passages)
+
+
+def _merge_run(run):
+    """Join consecutive chunks, skipping the words each one repeats from the previous (overlap)."""
+    parts = [run[0]["chunk"]]
+    for prev, h in zip(run, run[1:]):
+        skip = 0
+        if prev["meta"].get("word_end") is not None and h["meta"].get("word_start") is not None:
+            skip = max(prev["meta"]["word_end"] - h["meta"]["word_start"], 0)
+        parts.append(" ".join(h["chunk"].split()[skip:]))
+    return " ".join(p for p in parts if p)
+
+
+def _build_messages(question, hits, budget=CONTEXT_TOKEN_BUDGET):
+    """Chat messages for the answer LLM, or None when the hits hold no usable context."""
     if not hits:
-        return "The answer is not available in the provided transcripts."
+        return None
 
-    context = "\n\n".join([h["chunk"] for h in hits])
+    context = build_context(hits, budget)
 
     if len(context.strip()) < 20:
-        return "The answer is not available in the provided transcripts."
+        return None
 
     # ⭐ UPDATED SIMPLE, CONTROLLED PROMPT
     prompt = f"""
@@ -176,18 +814,71 @@ QUESTION:
 FINAL ANSWER (simple English only):
 """
 
+    return [
+        {
+            "role": "system",
+            "content": "Follow the RAG rules strictly. Answer only with simple English sentences, using context only."
+        },
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _answer_key(question, hits):
+    return (normalize_query(question),
+            tuple((h["meta"]["session_id"], h["meta"]["chunk_id"]) for h in hits))
+
+
+def answer_from_hits(question, hits):
+    """Answer from hits that were already retrieved (no second search)."""
+    # a repeated question skips context building (MMR + token counting) too
+    key = _answer_key(question, hits)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        return cached
+
+    messages = _build_messages(question, hits)
+    if messages is None:
+        return NO_ANSWER
+
     try:
-        response = client.chat.completions.create(
+        response = llm_gateway.chat(
             model="llama-3.1-8b-instant",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Follow the RAG rules strictly. Answer only with simple English sentences, using context only."
-                },
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
+            hedge=True,
         )
-        return response.choices[0].message.content.strip()
+        answer = response.choices[0].message.content.strip()
+        answer_cache.set(key, answer)
+        return answer
 
     except Exception as e:
         return f"LLM Error: {str(e)}"
+
+
+def stream_answer_from_hits(question, hits):
+    """Same as answer_from_hits, but yields answer text pieces as the LLM produces them."""
+    key = _answer_key(question, hits)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    messages = _build_messages(question, hits)
+    if messages is None:
+        yield NO_ANSWER
+        return
+
+    try:
+        stream = llm_gateway.chat_stream(
+            model="llama-3.1-8b-instant",
+            messages=messages,
+        )
+        pieces = []
+        for part in stream:
+            delta = part.choices[0].delta.content if part.choices else None
+            if delta:
+                pieces.append(delta)
+                yield delta
+        answer_cache.set(key, "".join(pieces).strip())
+
+    except Exception as e:
+        yield f"LLM Error: {str(e)}"
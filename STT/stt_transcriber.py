@@ -1,5 +1,5 @@
-from groq import Groq
-from config import GROQ_API_KEY
+import llm_gateway
+from transcript_store import save_store, store_path
 import os
 import json
 
@@ -25,8 +25,6 @@ def save_processed_audios(processed_list):
         json.dump({"audios": processed_list}, f, indent=4)
 
 def transcribe_new_audios():
-    client = Groq(api_key=GROQ_API_KEY)
-
     processed = load_processed_audios()
 
     all_audios = [f for f in os.listdir(audio_folder) if f.lower().endswith(".wav")]
@@ -44,17 +42,23 @@ def transcribe_new_audios():
 
         print(f"\n🎤 Transcribing: {audio}")
 
-        with open(input_path, "rb") as f:
-            response = client.audio.transcriptions.create(
-                file=f,
-                model="whisper-large-v3",
-                response_format="verbose_json",
-                timestamp_granularities=["word"]
-            )
+        response = llm_gateway.transcribe(
+            input_path,
+            model="whisper-large-v3",
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
+
+        data = response.model_dump()
+
+        # compact word-timestamp store (text + start/end/offset arrays)
+        words = data.get("words") or []
+        if words:
+            save_store(store_path(transcript_folder, base_name), words)
 
         json_output_path = os.path.join(transcript_folder, base_name + ".json")
         with open(json_output_path, "w", encoding="utf-8") as jf:
-            json.dump(response.model_dump(), jf, indent=4, ensure_ascii=False)
+            json.dump(data, jf, ensure_ascii=False, separators=(",", ":"))
 
         text_output_path = os.path.join(transcript_folder, base_name + ".txt")
         with open(text_output_path, "w", encoding="utf-8") as tf:
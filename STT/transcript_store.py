@@ -0,0 +1,122 @@
+"""
+Compact transcript store: one uncompressed .npz per session holding
+
+    text    - UTF-8 bytes of the words joined by single spaces (uint8)
+    offset  - byte offset of every word in `text` (int64)
+    start   - word start time in seconds (float32)
+    end     - word end time in seconds (float32)
+
+Lookups are binary searches over the sorted arrays, so time -> text and
+text -> time are O(log n) without parsing the Whisper verbose_json.
+"""
+import os
+import numpy as np
+
+
+def store_path(folder, session_id):
+    return os.path.join(folder, f"{session_id}.npz")
+
+
+def save_store(path, words):
+    """words: iterable of {"word", "start", "end"} dicts (Whisper verbose_json "words")."""
+    parts = []
+    offsets = []
+    starts = []
+    ends = []
+    pos = 0
+
+    for w in words:
+        token = str(w.get("word", "")).strip()
+        if not token:
+            continue
+        b = token.encode("utf-8")
+        offsets.append(pos)
+        parts.append(b)
+        starts.append(w.get("start") or 0.0)
+        ends.append(w.get("end") or 0.0)
+        pos += len(b) + 1
+
+    text = b" ".join(parts)
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        text=np.frombuffer(text, dtype=np.uint8),
+        offset=np.array(offsets, dtype=np.int64),
+        start=np.array(starts, dtype=np.float32),
+        end=np.array(ends, dtype=np.float32),
+    )
+    os.replace(tmp, path)
+    return len(offsets)
+
+
+class TranscriptStore:
+    def __init__(self, path):
+        with np.load(path) as data:
+            self._text = data["text"].tobytes()
+            self.offset = data["offset"]
+            self.start = data["start"]
+            self.end = data["end"]
+
+    def __len__(self):
+        return len(self.offset)
+
+    @property
+    def text(self):
+        return self._text.decode("utf-8", errors="ignore")
+
+    def _byte_end(self, i):
+        return int(self.offset[i + 1]) - 1 if i + 1 < len(self.offset) else len(self._text)
+
+    def word(self, i):
+        return self._text[int(self.offset[i]):self._byte_end(i)].decode("utf-8", errors="ignore")
+
+    def iter_words(self):
+        """Yield (word, start, end) in order."""
+        for i in range(len(self.offset)):
+            yield (self.word(i), float(self.start[i]), float(self.end[i]))
+
+    # ----- time -> text -----
+    def index_at(self, t):
+        """Index of the word being spoken at time t (the last word starting at or before t)."""
+        if not len(self.offset):
+            return None
+        i = int(np.searchsorted(self.start, t, side="right")) - 1
+        return max(i, 0)
+
+    def text_between(self, t0, t1):
+        """Words whose start time lies in [t0, t1]."""
+        lo = int(np.searchsorted(self.start, t0, side="left"))
+        hi = int(np.searchsorted(self.start, t1, side="right"))
+        if lo >= hi:
+            return ""
+        return self._text[int(self.offset[lo]):self._byte_end(hi - 1)].decode("utf-8", errors="ignore")
+
+    # ----- text -> time -----
+    def index_of_offset(self, byte_offset):
+        """Index of the word containing a byte offset into the stored text."""
+        i = int(np.searchsorted(self.offset, byte_offset, side="right")) - 1
+        return max(i, 0)
+
+    def find(self, phrase, from_time=0.0):
+        """
+        (start, end) of the first occurrence of `phrase` at or after from_time,
+        or None. The substring scan is linear; mapping the hit to time is a bisection.
+        """
+        needle = " ".join(phrase.split()).encode("utf-8")
+        if not needle or not len(self.offset):
+            return None
+
+        begin = 0
+        if from_time:
+            lo = int(np.searchsorted(self.start, from_time, side="left"))
+            if lo >= len(self.offset):
+                return None
+            begin = int(self.offset[lo])
+
+        pos = self._text.find(needle, begin)
+        if pos < 0:
+            return None
+
+        first = self.index_of_offset(pos)
+        last = self.index_of_offset(pos + len(needle) - 1)
+        return (float(self.start[first]), float(self.end[last]))